@@ -3,6 +3,7 @@ import logging
 
 import matplotlib.pyplot as plt
 from matplotlib.lines import Line2D
+import numpy as np
 
 @dataclass
 class BoxText:
@@ -16,6 +17,7 @@ class BoxText:
 @dataclass
 class BoxTextList:
     box_texts: list = field(default_factory=list)
+    _boxes: np.ndarray = field(default=None, init=False, repr=False, compare=False)  # cache for `boxes`
 
     def __len__(self) -> int:
         return len(self.box_texts)
@@ -26,12 +28,24 @@ class BoxTextList:
     def __getitem__(self, i) -> BoxText:
         return self.box_texts[i]
 
+    @property
+    def boxes(self) -> np.ndarray:
+        """Coordinates of all boxes, as an array with one row per box_text"""
+        if self._boxes is None:
+            self._boxes = np.array([box_text.box for box_text in self.box_texts], dtype=float)
+        return self._boxes
+
     def add(self, box, text, n=1) -> None:
         self.box_texts.append(BoxText(box, text, n))
+        self._boxes = None
 
     def sort(self) -> None:
         """Sort boxes by lexicographic order"""
-        self.box_texts.sort(key=lambda box_text: box_text.box)
+        if len(self.box_texts) == 0:
+            return
+        order = np.lexsort(self.boxes.T[::-1])  # last key is the primary one
+        self.box_texts[:] = [self.box_texts[i] for i in order]
+        self._boxes = self._boxes[order]
 
     def save(self, file):
         """Save box_texts to `file`"""
@@ -47,6 +61,7 @@ class BoxTextList:
         """Load box_texts from `file`"""
         logging.info(f"Load box_texts from {file}")
         self.box_texts = []
+        self._boxes = None
         with open(file, "r") as f:
             while True:
                 box = f.readline().rstrip('\n')
@@ -1,17 +1,24 @@
+import itertools
 import json
+import locale
 import logging
 import re
-from functools import partial
+from collections import defaultdict
+from functools import lru_cache
 from pathlib import Path
 
+import ijson
+import numpy as np
 import requests
-from symspellpy import SymSpell, Verbosity, editdistance
+from rapidfuzz import process
+from rapidfuzz.distance import OSA, Levenshtein
 
 from .box_text import BoxTextList
 from .deck import Deck, Pile
 
 URL_ALL_CARDS = "https://mtgjson.com/api/v5/VintageAtomic.json"  # URL to download card list, if needed
 URL_KEYWORDS = "https://mtgjson.com/api/v5/Keywords.json"
+REGEX_NOT_IN_CARD = re.compile("[^a-zA-Z',. ]")  # characters which can't appear on a Magic card
 
 
 def load_json(url):
@@ -20,6 +27,35 @@ def load_json(url):
     return r.json()
 
 
+def load_json_items(url, prefix):
+    """Stream the (key, value) pairs of the object at `prefix` in the JSON at `url`, without loading it entirely"""
+    print(f"Loading {url}")
+    with requests.get(url, stream=True) as r:
+        r.raise_for_status()
+        r.raw.decode_content = True  # let urllib3 decompress gzip
+        yield from ijson.kvitems(r.raw, prefix)
+
+
+def build_trie(words) -> dict:
+    """Build a character trie (dict of dicts) of `words`, (index, word) being stored at key None of its last node"""
+    trie = {}
+    for i, word in enumerate(words):
+        node = trie
+        for c in word:
+            node = node.setdefault(c, {})
+        node.setdefault(None, (i, word))
+    return trie
+
+
+def _first_word(node: dict) -> tuple:
+    """Return (index, word) of the first word inserted in the subtree of `node`, which has the smallest index"""
+    while True:
+        c, child = next(iter(node.items()))
+        if c is None:
+            return child
+        node = child
+
+
 class MagicRecognition:
     def __init__(self, file_all_cards: str, file_keywords: str, languages=("English",), max_ratio_diff=0.3, max_ratio_diff_keyword=0.2) -> None:
         """Load dictionnaries of cards and keywords
@@ -37,71 +73,90 @@ class MagicRecognition:
         """
         self.max_ratio_diff = max_ratio_diff
         self.max_ratio_diff_keyword = max_ratio_diff_keyword
-        
+        self._lookup = lru_cache(maxsize=4096)(self._lookup)  # OCR often gives the same texts (basic lands...)
+
         if not Path(file_all_cards).is_file():
             def write_card(f, card):
                 i = card.find(" //")
                 if i != -1:
                     card = card[:i]
-                f.write(card + "$1\n")  # required for SymSpell
-
-            all_cards_json = load_json(URL_ALL_CARDS)
-            with Path(file_all_cards).open("a") as f:
-                for card, l in all_cards_json["data"].items():
-                    if "English" in languages:
-                        write_card(f, card)
-                    for e in l[0]["foreignData"]:
-                        if e["language"] in languages:
-                            write_card(f, e["name"])
-
-        self.sym_all_cards = SymSpell(max_dictionary_edit_distance=6)
-        self.sym_all_cards._distance_algorithm = editdistance.DistanceAlgorithm.LEVENSHTEIN
-        self.sym_all_cards.load_dictionary(file_all_cards, 0, 1, separator="$")
-        self.all_cards = self.sym_all_cards._words
+                f.write(card + "$1\n")  # name$count, kept compatible with card lists written by older versions
+
+            # write to a temporary file first, so that a failed download doesn't leave a truncated card list
+            file_tmp = Path(file_all_cards).with_name(Path(file_all_cards).name + ".tmp")
+            try:
+                with file_tmp.open("w", encoding="utf-8") as f:
+                    for card, l in load_json_items(URL_ALL_CARDS, "data"):
+                        if "English" in languages:
+                            write_card(f, card)
+                        for e in l[0]["foreignData"]:
+                            if e["language"] in languages:
+                                write_card(f, e["name"])
+                file_tmp.replace(file_all_cards)
+            finally:
+                file_tmp.unlink(missing_ok=True)
+
+        data = Path(file_all_cards).read_bytes()
+        try:
+            lines = data.decode("utf-8").splitlines()
+        except UnicodeDecodeError:  # written by an older version, with the locale encoding
+            lines = data.decode(locale.getpreferredencoding(False), errors="replace").splitlines()
+        self.all_cards = {}  # card name -> index in file_all_cards
+        for line in lines:
+            name = line.split("$")[0]
+            if name != "":
+                self.all_cards.setdefault(name, len(self.all_cards))
+        self.all_cards_lower = {}  # lowercase name -> first card in file_all_cards with this name
+        self.cards_by_len = defaultdict(list)
+        for c in self.all_cards:
+            self.all_cards_lower.setdefault(c.lower(), c)
+            self.cards_by_len[len(c)].append(c)
+        self.trie_all_cards = build_trie(self.all_cards)
         print(f"Loaded {file_all_cards}: {len(self.all_cards)} cards")
-        self.edit_dist = editdistance.EditDistance(editdistance.DistanceAlgorithm.LEVENSHTEIN)
 
         if not Path(file_keywords).is_file():
             keywords = load_json(URL_KEYWORDS)
-            json.dump(keywords, Path(file_keywords).open("w"))
+            Path(file_keywords).write_text(json.dumps(keywords), encoding="utf-8")
 
-        def concat_lists(LL):
-            res = []
-            for L in LL:
-                res.extend(L)
-            return res
-
-        keywords_json = json.load(Path(file_keywords).open())
-        keywords = concat_lists(keywords_json["data"].values())
+        keywords_json = json.loads(Path(file_keywords).read_bytes())
+        keywords = list(itertools.chain.from_iterable(keywords_json["data"].values()))
         keywords.extend(["Display", "Land", "Search", "Profile"])
-        self.sym_keywords = SymSpell(max_dictionary_edit_distance=3)
-        for k in keywords:
-            self.sym_keywords.create_dictionary_entry(k, 1)
+        self.keywords = dict.fromkeys(keywords)  # some keywords appear in several categories
+        self.keywords_list = list(self.keywords)  # for rapidfuzz
+        self.len_keywords = (min(map(len, keywords)), max(map(len, keywords)))
         print(f"Loaded {file_keywords}: {len(keywords)} cards")
 
     def _preprocess(self, text: str) -> str:
         """Remove characters which can't appear on a Magic card (OCR error)"""
-        return re.sub("[^a-zA-Z',. ]", '', text).rstrip(' ')
+        return REGEX_NOT_IN_CARD.sub('', text).rstrip(' ')
 
-    def _preprocess_texts(self, box_texts: BoxTextList) -> None:
-        """Apply `preprocess` on each text"""
-        for box_text in box_texts:
-            box_text.text = self._preprocess(box_text.text)
+    def _text_to_card(self, text: str):
+        """Return the card recognized from raw `text`, or None if `text` is not a card name"""
+        card_text = self._preprocess(text)
+        if len(card_text) < 3:  # a card name is never that short
+            return None
+        if len(card_text) > 30:  # a card name is never that long
+            logging.info(f"Too long: {card_text}")
+            return None
+        if text in self.keywords:
+            logging.info(f"Keyword rejected: {text}")
+            return None
+        max_d = min(3, int(self.max_ratio_diff_keyword * len(text)))
+        if self.len_keywords[0] - max_d <= len(text) <= self.len_keywords[1] + max_d:  # else, can't be a keyword
+            sug = process.extractOne(text, self.keywords_list, scorer=OSA.distance, processor=None, score_cutoff=max_d)
+            if sug is not None:
+                logging.info(f"Keyword rejected: {text} {sug[1]/len(text)} {sug[0]}")
+                return None
+        return self._search(card_text)
 
     def box_texts_to_cards(self, box_texts: BoxTextList) -> BoxTextList:
         """Recognize cards from raw texts"""
         box_texts.sort()
         box_cards = BoxTextList()
         for box, text, _ in box_texts:
-            sug = self.sym_keywords.lookup(text,
-                                           Verbosity.CLOSEST,
-                                           max_edit_distance=min(3, int(self.max_ratio_diff_keyword * len(text))))
-            if sug != []:
-                logging.info(f"Keyword rejected: {text} {sug[0].distance/len(text)} {sug[0].term}")
-            else:
-                card = self._search(self._preprocess(text))
-                if card is not None:
-                    box_cards.add(box, card)
+            card = self._text_to_card(text)
+            if card is not None:
+                box_cards.add(box, card)
         return box_cards
 
     def _assign_stacked(self, box_texts: BoxTextList, box_cards: BoxTextList) -> None:
@@ -114,31 +169,34 @@ class MagicRecognition:
         box_cards : BoxTextList
             BoxTextList containing recognized cards
         """
-        def _assign_stacked_one(box_cards: BoxTextList, m: int, comp) -> None:
-            i_min = 0
-            for i, box_card in enumerate(box_cards):
-                if comp(box_card.box, box_cards[i_min].box):
-                    i_min = i
+        if len(box_cards) == 0:
+            return
+        coords = box_cards.boxes[:, :2]
+
+        def _assign_stacked_one(box_cards: BoxTextList, m: int, dists, box: tuple) -> None:
+            d, valid = dists(coords, box)
+            d_valid = np.where(valid, d, np.inf)
+            i_min = int(d_valid.argmin())
+            if not d_valid[i_min] < d[0]:  # the first card is kept if no valid card is strictly closer
+                i_min = 0
             box_cards[i_min].n = m
             logging.info(f"{box_cards[i_min].text} assigned to x{m}")
 
-        def dist(p: tuple, q: tuple) -> float:
-            return (p[0] - q[0])**2 + (p[1] - q[1])**2
+        def dist(coords: np.ndarray, box: tuple) -> np.ndarray:
+            return (coords[:, 0] - box[0])**2 + (coords[:, 1] - box[1])**2
 
-        def comp_md(box1: tuple, box2: tuple, box: tuple) -> float:
-            if box1[0] > box[0] or box1[1] > box[1]:
-                return False
-            return dist(box, box1) < dist(box, box2)
+        def dist_md(coords: np.ndarray, box: tuple) -> tuple:
+            return dist(coords, box), (coords[:, 0] <= box[0]) & (coords[:, 1] <= box[1])
 
-        def comp_sb(box1: tuple, box2: tuple, box: tuple) -> float:
-            return dist(box, box1) < dist(box, box2)
+        def dist_sb(coords: np.ndarray, box: tuple) -> tuple:
+            return dist(coords, box), np.ones(len(coords), dtype=bool)
 
-        comp = (comp_md, comp_sb)
+        dists = (dist_md, dist_sb)
         for box, text, _ in box_texts:
             if len(text) == 2:
                 for i in [0, 1]:
                     if text[i] in '×xX' and text[1 - i].isnumeric():
-                        _assign_stacked_one(box_cards, int(text[1 - i]), partial(comp[i], box=box))
+                        _assign_stacked_one(box_cards, int(text[1 - i]), dists[i], box)
 
     def _box_cards_to_deck(self, box_cards: BoxTextList) -> Deck:
         """Convert recognized cards to decklist"""
@@ -180,41 +238,94 @@ class MagicRecognition:
         self._assign_stacked(box_texts, box_cards)
         return self._box_cards_to_deck(box_cards)
 
+    def _search_prefix(self, prefix: str, max_dist: int):
+        """Return the card whose first len(`prefix`) characters are the closest to `prefix`, with their distance
+
+        The Levenshtein distance is computed row by row while walking down the trie of all cards,
+        so that a subtree is pruned as soon as it can't contain a card at distance < `max_dist`.
+        Ties are broken by the order of the cards in `file_all_cards`.
+        Return (None, `max_dist`) if there is no such card.
+        """
+        n = len(prefix)
+        best = [max_dist, -1, None]  # distance, index and name of the best card
+        if max_dist <= 0:  # no card can be at distance < 0
+            return None, max_dist
+
+        def update(d: int, first: tuple) -> None:
+            if (d, first[0]) < (best[0], best[1]):
+                best[:] = d, first[0], first[1]
+
+        def walk(node: dict, row: list, depth: int) -> None:
+            if depth == n:
+                update(row[n], _first_word(node))
+                return
+            if None in node:  # card shorter than prefix
+                update(row[n], node[None])
+            for c, child in node.items():
+                if c is None:
+                    continue
+                new_row = [row[0] + 1]
+                for j in range(1, n + 1):
+                    new_row.append(min(row[j] + 1, new_row[j - 1] + 1, row[j - 1] + (prefix[j - 1] != c)))
+                d_min = min(new_row)  # lower bound of the distance of any card in the subtree
+                if d_min < best[0] or d_min == best[0] and _first_word(child)[0] < best[1]:
+                    walk(child, new_row, depth + 1)
+
+        walk(self.trie_all_cards, list(range(n + 1)), 0)
+        return best[2], best[0]
+
+    def _search_fuzzy(self, text: str, max_d: int):
+        """Return (card, distance) for the card closest to `text`, if its distance is at most `max_d`. Otherwise, return None.
+
+        A card can't be closer than its length difference with `text`, so cards are compared by length,
+        from the closest lengths, and only while the length difference doesn't exceed the best distance.
+        Ties are broken by the order of the cards in `file_all_cards`.
+        """
+        best = None
+        for k in range(max_d + 1):
+            if best is not None and k > best[1]:
+                break
+            for n in {len(text) - k, len(text) + k}:
+                sug = process.extractOne(text,
+                                         self.cards_by_len.get(n, ()),
+                                         scorer=Levenshtein.distance,
+                                         processor=None,
+                                         score_cutoff=max_d if best is None else best[1])
+                if sug is not None and (best is None or (sug[1], self.all_cards[sug[0]]) < (best[1], self.all_cards[best[0]])):
+                    best = sug[:2]
+        return best
+
     def _search(self, text):
-        """If `text` can be recognized as a Magic card, return that card. Otherwise, return None."""
-        if len(text) < 3:  # a card name is never that short
-            return None
-        if len(text) > 30:  # a card name is never that long
-            logging.info(f"Too long: {text}")
-            return None
+        """If `text` can be recognized as a Magic card, return that card. Otherwise, return None.
+
+        `text` is expected to be preprocessed and between 3 and 30 characters long.
+        """
+        card, message = self._lookup(text)
+        if message is not None:  # logged here rather than in the cached _lookup, so that it is logged every time
+            logging.info(message)
+        return card
+
+    def _lookup(self, text) -> tuple:
+        """Return (card, message) with card as in `_search` (or None) and message to be logged (or None)"""
         if text in self.all_cards:
-            return text
+            return text, None
+        card = self.all_cards_lower.get(text.lower())
+        if card is not None:
+            return card, f"Corrected (case): {text} {card}"
         i = text.find("..")  # search for truncated card name
         if i != -1:
-            dist = int(self.max_ratio_diff * i)
-            card = None
-            for c in self.all_cards:
-                d = self.edit_dist.compare(text[:i], c[:i], dist)
-                if d != -1 and d < dist:
-                    card = c
-                    dist = d
+            card, dist = self._search_prefix(text[:i], int(self.max_ratio_diff * i))
             if card is None:
-                logging.info(f"Not prefix: {text}")
-            else:
-                logging.info(f"Found prefix: {text} {dist/i} {card}")
-                return card
-        else:
+                return None, f"Not prefix: {text}"
+            return card, f"Found prefix: {text} {dist/i} {card}"
+        if '.' in text:  # text is already right-stripped by _preprocess otherwise
             text = text.replace('.', '').rstrip(' ')
-            sug = self.sym_all_cards.lookup(text,
-                                            Verbosity.CLOSEST,
-                                            max_edit_distance=min(6, int(self.max_ratio_diff * len(text))))
-            if sug != []:
-                card = sug[0].term
-                ratio = sug[0].distance / len(text)
-                if len(text) < len(card) + 7:
-                    logging.info(f"Corrected: {text} {ratio} {card}")
-                    return card
-                logging.info(f"Not corrected (too long): {text} {ratio} {card}")
-            else:
-                logging.info(f"Not found: {text}")
-        return None
+        max_d = min(6, int(self.max_ratio_diff * len(text)))
+        sug = self._search_fuzzy(text, max_d)
+        if sug is None:
+            return None, f"Not found: {text}"
+        card, d = sug
+        ratio = d / len(text)
+        if len(text) < len(card) + 7:
+            return card, f"Corrected: {text} {ratio} {card}"
+        return None, f"Not corrected (too long): {text} {ratio} {card}"
@@ -0,0 +1,20 @@
+import json
+from pathlib import Path
+import sys
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parents[1]))
+from mtgscan.text import MagicRecognition
+
+
+@pytest.fixture
+def make_rec(tmp_path):
+    """Return a function building a MagicRecognition from lists of cards and keywords"""
+    def make(cards, keywords=("Flying",), **kwargs):
+        file_all_cards = tmp_path / "all_cards.txt"
+        file_all_cards.write_text("".join(f"{c}$1\n" for c in cards), encoding="utf-8")
+        file_keywords = tmp_path / "Keywords.json"
+        file_keywords.write_text(json.dumps({"data": {"keywordAbilities": list(keywords)}}), encoding="utf-8")
+        return MagicRecognition(str(file_all_cards), str(file_keywords), **kwargs)
+    return make
@@ -0,0 +1,16 @@
+import random
+
+from mtgscan.box_text import BoxTextList
+
+
+def test_sort():
+    rng = random.Random(0)
+    for n in range(20):  # including the empty list
+        box_texts = BoxTextList()
+        for i in range(n):
+            # few distinct coordinates, so that some boxes are equal
+            box_texts.add(tuple(rng.randrange(3) for _ in range(4)), str(i))
+        expected = sorted(box_texts, key=lambda box_text: box_text.box)
+        box_texts.sort()
+        assert box_texts.box_texts == expected
+        assert box_texts.boxes.tolist() == [list(box_text.box) for box_text in expected]
@@ -0,0 +1,48 @@
+import random
+
+from rapidfuzz.distance import Levenshtein
+
+CARDS = [
+    "Lightning Bolts", "Lightning Bolt", "Lightning Helix", "Lightning Axe", "Lightnin Bolt",
+    "Opt", "Ops", "Island", "Islands", "Brainstorm", "Brainstone", "Force of Will", "Force of Vigor",
+    "Counterspell", "Counterspelt", "Counterspell the Pearl", "Tarmogoyf", "Bloodghast", "Bloodstained Mire",
+]
+
+
+def search_fuzzy_brute_force(text: str, max_d: int):
+    """Reference implementation: scan all cards in order, as before the length buckets"""
+    best = None
+    for c in CARDS:
+        d = Levenshtein.distance(text, c)
+        if d <= max_d and (best is None or d < best[1]):
+            best = (c, d)
+    return best
+
+
+def queries(rng: random.Random, n: int):
+    """Cards with a few random characters substituted, deleted or inserted"""
+    for _ in range(n):
+        s = list(rng.choice(CARDS))
+        for _ in range(rng.randint(0, 5)):
+            i = rng.randrange(len(s) + 1)
+            op = rng.random()
+            if op < 0.4 and i < len(s):
+                s[i] = rng.choice("abeilostz ")
+            elif op < 0.7 and i < len(s) and len(s) > 1:
+                del s[i]
+            else:
+                s.insert(i, rng.choice("abeilostz "))
+        yield "".join(s)
+
+
+def test_search_fuzzy(make_rec):
+    rec = make_rec(CARDS)
+    for text in queries(random.Random(0), 2000):
+        for max_d in (0, 1, 2, 3, 6):
+            assert rec._search_fuzzy(text, max_d) == search_fuzzy_brute_force(text, max_d), (text, max_d)
+    # ties are broken by position in the file, whatever the length of the card
+    assert rec._search_fuzzy("Lightning Boltz", 3) == ("Lightning Bolts", 1)
+    assert rec._search_fuzzy("Lightning Bols", 3) == ("Lightning Bolts", 1)
+    # lengths up to the best distance so far are still searched for an earlier card
+    assert rec._search_fuzzy("Islandz", 3) == ("Island", 1)
+    assert rec._search_fuzzy("Opts", 3) == ("Opt", 1)
@@ -0,0 +1,48 @@
+import json
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).parents[1]))
+from rapidfuzz.distance import Levenshtein
+from mtgscan.text import MagicRecognition
+
+CARDS = [
+    "Counterspell the Pearl", "Counterspell", "Counterspelt", "Tarmogoyf the Sol Lotus", "Tarmogoyf",
+    "Opt", "Ops", "Island", "Islands Edge", "Lightning Bolt", "Lightning Helix", "Lightning Axe",
+    "Brainstorm", "Brainstone", "Bloodstained Mire", "Bloodghast", "Force of Will", "Force of Vigor",
+]
+
+
+def search_prefix_brute_force(prefix: str, max_dist: int):
+    """Reference implementation: scan all cards in order, as before the trie"""
+    card, dist = None, max_dist
+    for c in CARDS:
+        d = Levenshtein.distance(prefix, c[:len(prefix)])
+        if d < dist:
+            card, dist = c, d
+    return card, dist
+
+
+def queries():
+    """Prefixes of every card, as is and with one character substituted, deleted or inserted"""
+    for c in CARDS:
+        for i in range(1, len(c) + 3):
+            p = c[:i]
+            yield p
+            for j in range(len(p)):
+                yield p[:j] + "z" + p[j + 1:]
+                yield p[:j] + p[j + 1:]
+                yield p[:j] + "e" + p[j:]
+
+
+def test_search_prefix(tmp_path):
+    file_all_cards = tmp_path / "all_cards.txt"
+    file_all_cards.write_text("".join(f"{c}$1\n" for c in CARDS), encoding="utf-8")
+    file_keywords = tmp_path / "Keywords.json"
+    file_keywords.write_text(json.dumps({"data": {"keywordAbilities": ["Flying"]}}), encoding="utf-8")
+    rec = MagicRecognition(str(file_all_cards), str(file_keywords))
+    for prefix in queries():
+        for max_dist in range(5):
+            assert rec._search_prefix(prefix, max_dist) == search_prefix_brute_force(prefix, max_dist), prefix
+    assert rec._search_prefix("Counterspelle", 3) == ("Counterspell the Pearl", 1)
+    assert rec._search_prefix("TarmogYoyf ", 3) == ("Tarmogoyf the Sol Lotus", 2)
@@ -0,0 +1,90 @@
+import logging
+import random
+
+from mtgscan.box_text import BoxTextList
+
+
+def test_search_logs_cached_texts(make_rec, caplog):
+    rec = make_rec(["Lightning Bolt", "Opt"])
+    box_texts = BoxTextList()
+    box_texts.add((0, 0), "Lightnin Bolt")
+    box_texts.add((0, 10), "Lightnin Bolt")
+    with caplog.at_level(logging.INFO):
+        for _ in range(2):
+            box_cards = rec.box_texts_to_cards(box_texts)
+            assert [box_card.text for box_card in box_cards] == ["Lightning Bolt"] * 2
+    assert sum("Corrected: Lightnin Bolt" in r.message for r in caplog.records) == 4
+
+
+def assign_stacked_sequential(box_texts: BoxTextList, box_cards: BoxTextList) -> None:
+    """Reference implementation: compare the boxes one by one, as before the vectorization"""
+    def dist(p, q):
+        return (p[0] - q[0])**2 + (p[1] - q[1])**2
+
+    for box, text, _ in box_texts:
+        if len(text) == 2:
+            for i in [0, 1]:
+                if text[i] in '×xX' and text[1 - i].isnumeric():
+                    i_min = 0
+                    for j, box_card in enumerate(box_cards):
+                        if i == 0 and (box_card.box[0] > box[0] or box_card.box[1] > box[1]):
+                            continue
+                        if dist(box, box_card.box) < dist(box, box_cards[i_min].box):
+                            i_min = j
+                    box_cards[i_min].n = int(text[1 - i])
+
+
+def test_assign_stacked(make_rec):
+    rec = make_rec(["Opt"])
+    rng = random.Random(0)
+
+    def box():  # few distinct coordinates, so that many boxes are at the same distance
+        return (rng.randrange(5), rng.randrange(5), 10, 10)
+
+    for _ in range(500):
+        box_texts, box_cards, expected = BoxTextList(), BoxTextList(), BoxTextList()
+        for _ in range(rng.randrange(6)):
+            box_texts.add(box(), rng.choice(["x4", "3x", "X2", "×1", "xx", "Opt"]))
+        for i in range(rng.randrange(1, 8)):
+            b = box()
+            box_cards.add(b, str(i))
+            expected.add(b, str(i))
+        rec._assign_stacked(box_texts, box_cards)
+        assign_stacked_sequential(box_texts, expected)
+        assert [c.n for c in box_cards] == [c.n for c in expected]
+
+
+def test_assign_stacked_no_card(make_rec):
+    """A multiplier without any recognized card is ignored"""
+    rec = make_rec(["Opt"])
+    box_texts = BoxTextList()
+    box_texts.add((0, 0, 10, 10), "x4")
+    box_cards = BoxTextList()
+    rec._assign_stacked(box_texts, box_cards)
+    assert len(box_cards) == 0
+
+
+def test_keywords(make_rec):
+    kept = [
+        "Lan", "Lond",  # no edit allowed below 5 characters
+        "Flxyimg",  # 2 edits for 7 characters
+        "Trampoline",  # 3 edits for 10 characters
+        "Landwalksss",  # longer than any keyword plus the allowed distance
+    ]
+    rec = make_rec(kept, keywords=["Flying", "Trample", "Landwalk"])  # "Land" and "Profile" are added
+    assert rec.len_keywords == (4, 8)
+    for text in kept:
+        assert rec._text_to_card(text) == text, text
+    for text in [
+        "Flying", "Land",  # exact match, whatever the allowed distance
+        "Flyimg", "Flyign",  # 1 substitution or transposition, for 5 to 9 characters
+        "Landwalkss",  # 2 edits for 10 characters, the longest text which can be a keyword
+        "Profle",
+    ]:
+        assert rec._text_to_card(text) is None, text
+
+
+def test_search_case(make_rec):
+    rec = make_rec(["Lightning Bolt", "Dark Ritual", "Lightning bolt"])
+    assert rec._search("lightning bolt") == "Lightning Bolt"  # first card in the file
+    assert rec._search("Lightning bolt") == "Lightning bolt"